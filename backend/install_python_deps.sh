@@ -0,0 +1,12 @@
+#!/usr/bin/env bash
+# Render build script: system libraries first, then Python dependencies.
+set -e
+
+# GL/EGL headers so the MediaPipe Tasks GPU delegate can initialize, and
+# libturbojpeg for the fast JPEG decode path (optional; cv2 is the fallback).
+apt-get update && apt-get install -y --no-install-recommends \
+    mesa-common-dev libegl1-mesa-dev libgles2-mesa-dev libturbojpeg0 || \
+    echo "WARNING: could not install GL/turbojpeg libraries; falling back to CPU delegate and cv2 decode."
+
+pip install --upgrade pip
+pip install -r requirements.txt
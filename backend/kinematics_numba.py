@@ -0,0 +1,59 @@
+"""Scalar kinematics kernels, compiled with numba when it is installed.
+
+These are the pure-math leaves of the analysis path (joint angle and
+accuracy scoring). They take and return plain floats so numba compiles
+them to tight machine code with no object-mode boxing; without numba the
+same functions run as ordinary Python and everything still works.
+"""
+import math
+
+import numpy as np
+
+try:
+  from numba import njit
+except ImportError:
+  def njit(*args, **kwargs):
+    if args and callable(args[0]): return args[0]
+    def wrap(func): return func
+    return wrap
+
+@njit(cache=True, fastmath=True)
+def angle_2d(ax, ay, bx, by, cx, cy):
+  """Angle at vertex B in degrees via atan2(|cross|, dot).
+
+  One atan2 instead of two, no wrap-around branch, and exact behaviour at
+  the 0/180-degree extremes where the arccos form needs clipping.
+  Degenerate joints (A==B or C==B) still need the explicit guard: the dot
+  product can come out as -0.0 there, and atan2(0, -0.0) is pi.
+  """
+  vax, vay = ax - bx, ay - by
+  vcx, vcy = cx - bx, cy - by
+  if (vax == 0.0 and vay == 0.0) or (vcx == 0.0 and vcy == 0.0): return 0.0
+  return math.atan2(abs(vax * vcy - vay * vcx), vax * vcx + vay * vcy) * 180.0 / math.pi
+
+@njit(cache=True, fastmath=True)
+def accuracy(current_angle, min_range, max_range):
+  """Accuracy score in [0, 100] with the 10-degree tolerance buffer."""
+  if min_range >= max_range: return 0.0
+  if min_range <= current_angle <= max_range: return 100.0
+  deviation = max(min_range - current_angle, current_angle - max_range)
+  if deviation > 10.0: return 0.0
+  return max(0.0, min(100.0, 100.0 * (1.0 - deviation / 10.0)))
+
+@njit(cache=True, fastmath=True)
+def joint_angle(pts, ia, ib, ic, vis_threshold):
+  """Fused visibility gate + angle over the (33, 3) landmark buffer.
+
+  Returns (angle_degrees, visible_ok); one compiled call replaces the
+  separate numpy gate, scalar unboxing and angle call per frame.
+  """
+  if pts[ia, 2] < vis_threshold or pts[ib, 2] < vis_threshold or pts[ic, 2] < vis_threshold:
+    return 0.0, False
+  return angle_2d(pts[ia, 0], pts[ia, 1], pts[ib, 0], pts[ib, 1], pts[ic, 0], pts[ic, 1]), True
+
+# Trigger compilation at import so the first analyzed frame doesn't pay
+# the JIT cost; cache=True makes later imports load the compiled kernels
+# from disk.
+angle_2d(0.0, 0.0, 1.0, 0.0, 1.0, 1.0)
+accuracy(90.0, 30.0, 160.0)
+joint_angle(np.ones((33, 3), dtype=np.float32), 0, 1, 2, 0.5)
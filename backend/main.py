@@ -1,21 +1,37 @@
 import os
+# Before numpy/cv2/mediapipe import: keep their OpenMP/BLAS pools
+# single-threaded. Parallelism comes from the pose worker pool, and
+# per-op thread pools oversubscribe the same cores and add jitter.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+
+import asyncio
 import base64
 import cv2
 import numpy as np
 import time
 import json
 import datetime
-import traceback
+import functools
+import struct
+import hashlib
+import itertools
+import threading
+import logging
+import queue
 import io
+from logging.handlers import QueueHandler, QueueListener
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
 from typing import List, Optional, Dict, Any, Tuple
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import Response
 from pydantic import BaseModel, Field
 from weasyprint import HTML
-from starlette.background import BackgroundTask
 
 from supabase import create_client, Client
 from gotrue.errors import AuthApiError
@@ -25,8 +41,30 @@ import mediapipe as mp
 
 import joblib
 import pandas as pd
+
+import kinematics_numba
+
+try:
+  from numba import njit
+except ImportError:
+  # numba is optional: without it the kernels run as plain Python.
+  def njit(*args, **kwargs):
+    if args and callable(args[0]): return args[0]
+    def wrap(func): return func
+    return wrap
 # -----------------------------------------------------------
 
+# === Logging Setup ===
+# Stderr writes happen on the QueueListener thread, so request threads and
+# the event loop never block on a slow log flush.
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_handler, respect_handler_level=True)
+_log_listener.start()
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(_log_queue)], force=True)
+log = logging.getLogger("physio_api")
+
 # === GLOBAL INITIALIZATION ===
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 SUPABASE_URL = os.environ.get("VITE_SUPABASE_URL")
@@ -34,7 +72,7 @@ SUPABASE_KEY = os.environ.get("VITE_SUPABASE_ANON_KEY")
 
 # === Gemini Setup ===
 if not GEMINI_API_KEY:
-    print("⚠️ WARNING: GEMINI_API_KEY environment variable is not set. AI chat will fail.")
+    log.warning("GEMINI_API_KEY environment variable is not set. AI chat will fail.")
 ai_client = genai.Client(api_key=GEMINI_API_KEY)
 MODEL_NAME = "gemini-2.5-flash"
 active_chats: Dict[str, any] = {}
@@ -44,13 +82,199 @@ active_chats: Dict[str, any] = {}
 # 1. MEDIAPIPE & FASTAPI SETUP
 # =========================================================================
 mp_pose = mp.solutions.pose
-pose = mp_pose.Pose(
-    min_detection_confidence=0.5,
-    min_tracking_confidence=0.5
-)
 
+# Tasks-API landmarker (GPU-capable). Set POSE_MODEL_PATH to a downloaded
+# pose_landmarker_*.task asset; without it we fall back to the legacy
+# CPU-only solution so local dev keeps working. An INT8-quantized bundle
+# (pose_landmarker_lite_int8.task, produced offline with tflite_convert
+# --optimizations=DEFAULT on the lite model) is preferred when present:
+# it runs ~2-3x faster on the XNNPACK CPU delegate and halves model
+# bandwidth, at a small landmark-precision cost that rep counting
+# tolerates.
+_POSE_MODEL_CANDIDATES = [p for p in (
+    os.environ.get("POSE_MODEL_PATH"),
+    "model/pose_landmarker_lite_int8.task",
+    "model/pose_landmarker_lite.task",
+) if p]
+POSE_MODEL_PATH = next((p for p in _POSE_MODEL_CANDIDATES if os.path.exists(p)), _POSE_MODEL_CANDIDATES[-1])
+POSE_DELEGATE = os.environ.get("POSE_DELEGATE", "gpu").lower()
+# Legacy-solution fallback only: 0=lite, 1=full, 2=heavy.
+POSE_MODEL_COMPLEXITY = int(os.environ.get("POSE_MODEL_COMPLEXITY", "0"))
+
+def _create_pose_landmarker():
+  from mediapipe.tasks import python as mp_tasks
+  from mediapipe.tasks.python import vision as mp_vision
+  delegates = [mp_tasks.BaseOptions.Delegate.CPU] if POSE_DELEGATE == "cpu" else [mp_tasks.BaseOptions.Delegate.GPU, mp_tasks.BaseOptions.Delegate.CPU]
+  last_error = None
+  for delegate in delegates:
+    try:
+      options = mp_vision.PoseLandmarkerOptions(
+          base_options=mp_tasks.BaseOptions(model_asset_path=POSE_MODEL_PATH, delegate=delegate),
+          running_mode=mp_vision.RunningMode.VIDEO,
+          num_poses=1,
+          min_pose_detection_confidence=0.5,
+          min_tracking_confidence=0.5,
+      )
+      landmarker = mp_vision.PoseLandmarker.create_from_options(options)
+      log.info(f"PoseLandmarker initialized ({delegate.name} delegate).")
+      return landmarker
+    except Exception as e:
+      last_error = e
+      log.warning(f"PoseLandmarker init failed with {delegate.name} delegate: {e}")
+  raise last_error
+
+# Experimental: run the BlazePose landmark head through ONNX Runtime
+# instead of the mediapipe graph. Opt-in (USE_ONNX_POSE=1) because it
+# trades the graph's detector/tracker logic for raw full-frame landmark
+# regression; POSE_ONNX_PATH points at an exported pose_landmark_*.onnx.
+USE_ONNX_POSE = os.environ.get("USE_ONNX_POSE", "0") == "1"
+POSE_ONNX_PATH = os.environ.get("POSE_ONNX_PATH", "model/pose_landmark_lite.onnx")
+
+class _OnnxLandmark:
+  __slots__ = ("x", "y", "visibility")
+  def __init__(self, x, y, visibility):
+    self.x, self.y, self.visibility = x, y, visibility
+
+class OnnxPoseSession:
+  """Minimal ONNX Runtime wrapper for the BlazePose landmark model.
+
+  Expects the standard landmark head output: (1, 195) = 39 rows of
+  [x, y, z, visibility, presence] in input-pixel units with logit scores.
+  Only the first 33 (the PoseLandmark set) are kept.
+  """
+  def __init__(self):
+    import onnxruntime as ort
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = 1
+    opts.inter_op_num_threads = 1
+    self.session = ort.InferenceSession(POSE_ONNX_PATH, sess_options=opts, providers=["CPUExecutionProvider"])
+    inp = self.session.get_inputs()[0]
+    self.input_name = inp.name
+    self.size = int(inp.shape[2]) if isinstance(inp.shape[2], int) else 256
+
+  def detect(self, image_rgb):
+    resized = cv2.resize(image_rgb, (self.size, self.size), interpolation=cv2.INTER_AREA)
+    tensor = (resized.astype(np.float32) / 255.0)[np.newaxis]
+    raw = self.session.run(None, {self.input_name: tensor})[0].reshape(-1, 5)[:33]
+    xy = raw[:, :2] / self.size
+    vis = 1.0 / (1.0 + np.exp(-raw[:, 3]))
+    if float(vis.mean()) < 0.1: return None
+    return [_OnnxLandmark(float(x), float(y), float(v)) for (x, y), v in zip(xy, vis)]
+
+class PoseWorker:
+  """One pose graph plus the per-graph state a MediaPipe graph cannot share.
+
+  A single graph serializes calls (batch size is always 1), so throughput
+  comes from running several workers side by side.
+  """
+  def __init__(self):
+    self.landmarker = None
+    self.pose = None
+    self.onnx = None
+    if USE_ONNX_POSE:
+      try:
+        self.onnx = OnnxPoseSession()
+        log.info(f"ONNX pose session initialized from {POSE_ONNX_PATH}.")
+      except Exception as e:
+        log.warning(f"USE_ONNX_POSE set but ONNX init failed, falling back to mediapipe: {e}")
+    if self.onnx is None and os.path.exists(POSE_MODEL_PATH):
+      try:
+        self.landmarker = _create_pose_landmarker()
+      except Exception as e:
+        log.warning(f"Tasks-API init failed entirely, using legacy Pose: {e}")
+    if self.onnx is None and self.landmarker is None:
+      # Lite model (complexity 0) runs ~2x faster than the default full
+      # model; our joint angles tolerate its precision. Segmentation is off
+      # because nothing consumes the mask, and smoothing stays on since the
+      # feed is a continuous video stream.
+      self.pose = mp_pose.Pose(
+          model_complexity=POSE_MODEL_COMPLEXITY,
+          smooth_landmarks=True,
+          enable_segmentation=False,
+          min_detection_confidence=0.5,
+          min_tracking_confidence=0.5
+      )
+    # VIDEO running mode requires monotonically increasing timestamps per graph.
+    self.timestamp_ms = 0
+    self.lock = threading.Lock()
+
+  def detect(self, image_rgb):
+    with self.lock:
+      if self.onnx is not None:
+        return self.onnx.detect(image_rgb)
+      if self.landmarker is not None:
+        rgba = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2RGBA)
+        mp_image = mp.Image(image_format=mp.ImageFormat.SRGBA, data=rgba)
+        self.timestamp_ms += 33
+        result = self.landmarker.detect_for_video(mp_image, self.timestamp_ms)
+        if not result.pose_landmarks: return None
+        return result.pose_landmarks[0]
+      results = self.pose.process(image_rgb)
+      if not results.pose_landmarks: return None
+      return results.pose_landmarks.landmark
+
+POSE_POOL_SIZE = max(1, int(os.environ.get("POSE_POOL_SIZE", "2")))
+POSE_POOL = [PoseWorker() for _ in range(POSE_POOL_SIZE)]
+_pose_pool_cursor = itertools.count()
+_pose_pool_binding = threading.local()
+
+def detect_pose_landmarks(image_rgb):
+  """Runs pose inference on an RGB frame; returns the 33 landmarks or None.
+
+  Each calling thread sticks to one worker (assigned round-robin on first
+  use) so its graph keeps a warm tracking state and an uncontended lock;
+  with the executor sized to the pool, every graph gets its own thread.
+  """
+  worker = getattr(_pose_pool_binding, "worker", None)
+  if worker is None:
+    worker = POSE_POOL[next(_pose_pool_cursor) % POSE_POOL_SIZE]
+    _pose_pool_binding.worker = worker
+  return worker.detect(image_rgb)
+
+# JPEG decode and the mediapipe graphs both release the GIL, so a small
+# thread pool gives real parallelism. One thread per pose graph: wider
+# would just queue on the per-worker locks.
+_frame_executor = ThreadPoolExecutor(max_workers=POSE_POOL_SIZE, thread_name_prefix="frame")
+
+_rgb_buffers = threading.local()
+
+def bgr_to_rgb(frame):
+  """BGR->RGB conversion into a per-thread reusable buffer.
+
+  Avoids allocating a fresh H*W*3 array (~900 KB at 640x480) on every
+  frame; mediapipe copies the data into its own packet, so reusing the
+  buffer on the next frame is safe.
+  """
+  buf = getattr(_rgb_buffers, "buf", None)
+  if buf is None or buf.shape != frame.shape:
+    buf = np.empty_like(frame)
+    _rgb_buffers.buf = buf
+  cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=buf)
+  return buf
+
+
+# orjson serializes ~2-5x faster than the stdlib encoder and handles the
+# numpy scalars that leak into per-frame responses.
+try:
+  import orjson
+  from fastapi.responses import ORJSONResponse
+
+  class NumpyORJSONResponse(ORJSONResponse):
+    def render(self, content: Any) -> bytes:
+      return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
 
-app = FastAPI(title="AI Physiotherapy API")
+  _default_response_class = NumpyORJSONResponse
+
+  def _json_dumps(obj) -> str:
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+  _json_loads = orjson.loads
+except ImportError:
+  from fastapi.responses import JSONResponse as _default_response_class
+  log.warning("orjson not installed; falling back to the stdlib JSON encoder.")
+  _json_dumps = json.dumps
+  _json_loads = json.loads
+
+app = FastAPI(title="AI Physiotherapy API", default_response_class=_default_response_class)
 
 FRONTEND_ORIGIN = "https://exercise-frontend-tt5l.onrender.com"
 app.add_middleware(
@@ -66,15 +290,20 @@ class UserCredentials(BaseModel):
 class ChatRequest(BaseModel): message: str; session_id: str
 
 # --- SUPABASE CONFIGURATION ---
-try:
+@functools.lru_cache(maxsize=1)
+def get_supabase_client() -> Client:
+    """Builds the shared Supabase client on first use.
+
+    Lazy so that importing main (tests, tooling, misconfigured envs) does
+    not construct a client against bogus credentials; the lru_cache keeps
+    it a single client so HTTP keep-alive connections are reused.
+    """
     if not SUPABASE_URL or not SUPABASE_KEY:
-        print("⚠️ WARNING: Supabase credentials missing. Session saving will fail.")
-        supabase: Client = create_client("http://localhost", "fake_key")
-    else:
-        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-        print("Supabase client initialized.")
-except Exception as e:
-    print(f"CRITICAL SUPABASE INIT ERROR: {e}")
+        log.warning("Supabase credentials missing. Session saving will fail.")
+        return create_client("http://localhost", "fake_key")
+    client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    log.info("Supabase client initialized.")
+    return client
 # ---------------------------------------------------------------------
 
 # =========================================================================
@@ -89,9 +318,14 @@ class Landmark2D(BaseModel):
   visibility: float = 1.0
 
 class FrameRequest(BaseModel):
-  frame: str
+  frame: str = ""
+  frames: Optional[List[str]] = None
   exercise_name: str
   previous_state: Dict | None = None
+  include_landmarks: bool = True
+  # When set, rep-counting state is cached server-side under this key and
+  # previous_state no longer needs to round-trip on every request.
+  session_id: Optional[str] = None
 
 class AilmentRequest(BaseModel):
   ailment: str
@@ -124,224 +358,577 @@ EXERCISE_PLANS = {
   "wrist injury": {"ailment": "wrist injury", "exercises": [{ "name": "Wrist Flexion", "description": "Bend your wrist forward and back.", "target_reps": 5, "sets": 3, "rest_seconds": 30 }], "difficulty_level": "beginner", "duration_weeks": 3}
 }
 
+# The plans never change at runtime, so serialize each once at import and
+# serve the raw bytes instead of re-walking the nested dicts per request.
+_PLAN_BYTES = {name: _json_dumps(plan).encode() for name, plan in EXERCISE_PLANS.items()}
+
 # =========================================================================
 # 3. UTILITY FUNCTIONS (Unchanged)
 # =========================================================================
-def get_best_side(landmarks):
-  left_vis = (landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER.value].visibility + landmarks[mp_pose.PoseLandmark.LEFT_HIP.value].visibility) / 2
-  right_vis = (landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER.value].visibility + landmarks[mp_pose.PoseLandmark.RIGHT_HIP.value].visibility) / 2
-  if left_vis > right_vis and left_vis > 0.6: return "left"
-  elif right_vis > 0.6: return "right"
-  else: return None
+# (2, 2) [side, joint] visibility probe indices: shoulder+hip per side.
+_SIDE_VIS_INDICES = np.array([
+  [mp_pose.PoseLandmark.LEFT_SHOULDER.value, mp_pose.PoseLandmark.LEFT_HIP.value],
+  [mp_pose.PoseLandmark.RIGHT_SHOULDER.value, mp_pose.PoseLandmark.RIGHT_HIP.value],
+], dtype=np.intp)
+
+def get_best_side(landmarks, pts=None):
+  """Picks the more visible side from the SoA buffer in one fancy-indexed read.
+
+  Same decision as the old attribute-access version: left needs strictly
+  higher mean visibility to win, and the winner still needs > 0.6.
+  """
+  if pts is None: pts = landmarks_to_array(landmarks)
+  left_vis, right_vis = pts[_SIDE_VIS_INDICES, 2].mean(axis=1)
+  best = 0 if left_vis > right_vis else 1
+  if (left_vis if best == 0 else right_vis) <= 0.6: return None
+  return "left" if best == 0 else "right"
+
+def calculate_angles_2d(A, B, C):
+  """Batched joint angles: (N, 2) coordinate arrays in, (N,) degrees out.
+
+  One numpy pass over stacked joints instead of N scalar calls; degenerate
+  joints (A==B or C==B) come back as 0.0 like the scalar version always did.
+  """
+  A = np.asarray(A, dtype=np.float32).reshape(-1, 2)
+  B = np.asarray(B, dtype=np.float32).reshape(-1, 2)
+  C = np.asarray(C, dtype=np.float32).reshape(-1, 2)
+  # atan2(|cross|, dot) of the B->A and B->C vectors: one atan2 per joint
+  # and exact at the 0/180-degree extremes. Degenerate joints are masked to
+  # 0 explicitly, since their dot product can land on -0.0 and atan2(0,
+  # -0.0) is pi.
+  VA, VC = A - B, C - B
+  cross = VA[:, 0] * VC[:, 1] - VA[:, 1] * VC[:, 0]
+  dot = VA[:, 0] * VC[:, 0] + VA[:, 1] * VC[:, 1]
+  angles = np.degrees(np.arctan2(np.abs(cross), dot))
+  angles[np.all(A == B, axis=1) | np.all(C == B, axis=1)] = 0.0
+  return angles
 
 def calculate_angle_2d(a, b, c):
-  a, b, c = np.array(a), np.array(b), np.array(c)
-  if np.all(a == b) or np.all(c == b): return 0.0
-  radians = np.arctan2(c[1] - b[1], c[0] - b[0]) - np.arctan2(a[1] - b[1], a[0] - b[0])
-  angle = np.abs(radians * 180.0 / np.pi)
-  if angle > 180.0: angle = 360 - angle
-  return angle
-
-def get_2d_landmarks(landmarks):
-  return [{"x": lm.x, "y": lm.y, "visibility": lm.visibility} for lm in landmarks]
+  return kinematics_numba.angle_2d(float(a[0]), float(a[1]), float(b[0]), float(b[1]), float(c[0]), float(c[1]))
+
+def get_2d_landmarks(landmarks, pts=None):
+  # Serialized as 33 flat [x, y, visibility] triples straight from the SoA
+  # array: one .tolist() C call, no per-landmark dicts or key strings on
+  # the wire. LiveSession.tsx indexes the triples positionally.
+  # Rounded to 4 decimals in float64 first: float32 -> double conversion
+  # otherwise yields ~17 significant digits per value in the JSON, and at
+  # normalized coordinates 1e-4 is far below a pixel on any display.
+  if pts is None: pts = landmarks_to_array(landmarks)
+  return pts.astype(np.float64).round(4).tolist()
 
 def calculate_accuracy(current_angle: float, min_range: float, max_range: float) -> float:
-  if min_range >= max_range: return 0.0
-  TARGET_MIN, TARGET_MAX, BUFFER = min_range, max_range, 10
-  if current_angle >= TARGET_MIN and current_angle <= TARGET_MAX: return 100.0
-  deviation = max(TARGET_MIN - current_angle, current_angle - TARGET_MAX)
-  if deviation > BUFFER: return 0.0
-  score = 100 * (1 - (deviation / BUFFER))
-  return max(0.0, min(100.0, score))
+  return kinematics_numba.accuracy(float(current_angle), float(min_range), float(max_range))
+
+@njit(cache=True)
+def _update_rep_state(angle, reps, stage_up, last_rep_time, dyn_min, dyn_max, frame_count, partial_buf, calibrated, now, calib_frames, debounce):
+  """Pure scalar rep-counting transition, compiled by numba when installed.
+
+  Feedback is returned as integer codes (calibrating flag, instruction,
+  rep event, progress hint) and mapped to user-facing strings by the
+  caller, keeping all Python objects out of the jitted path.
+  """
+  accuracy = 0.0
+  calibrating = False
+  instr_code = 0
+  rep_code = 0
+  prog_code = 0
+  # Once calibrated sticks, the min/max tracking below is skipped for good
+  # on a single flag test instead of re-evaluating both compares per frame.
+  if calibrated == 0 and frame_count < calib_frames and reps == 0:
+    if angle > dyn_max: dyn_max = angle
+    if angle < dyn_min: dyn_min = angle
+    frame_count += 1
+    calibrating = True
+  if calibrated == 1 or frame_count >= calib_frames or reps > 0:
+    calibrated = 1
+    min_full, max_full = dyn_min + 5.0, dyn_max - 5.0
+    min_partial, max_partial = dyn_min + 20.0, dyn_max - 20.0
+    if dyn_min >= dyn_max:
+      accuracy = 0.0
+    elif dyn_min <= angle <= dyn_max:
+      accuracy = 100.0
+    else:
+      deviation = max(dyn_min - angle, angle - dyn_max)
+      if deviation > 10.0:
+        accuracy = 0.0
+      else:
+        accuracy = max(0.0, min(100.0, 100.0 * (1.0 - deviation / 10.0)))
+    if angle < min_partial:
+      stage_up = 1
+      instr_code = 1 if angle < min_full else 2
+    if angle > max_partial and stage_up == 1:
+      if now - last_rep_time > debounce:
+        rep_amount = 1.0 if angle > max_full else 0.5
+        stage_up = 0
+        partial_buf += rep_amount
+        last_rep_time = now
+        if partial_buf >= 1.0:
+          reps += int(partial_buf)
+          partial_buf = partial_buf % 1.0
+        rep_code = 1 if rep_amount == 1.0 else 2
+      else:
+        rep_code = 3
+    if instr_code == 0 and rep_code == 0:
+      if stage_up == 1 and angle > min_full: prog_code = 1
+      elif stage_up == 0 and angle < max_full: prog_code = 2
+      elif stage_up == 0: prog_code = 3
+      else: prog_code = 4
+  return reps, stage_up, last_rep_time, dyn_min, dyn_max, frame_count, partial_buf, calibrated, accuracy, calibrating, instr_code, rep_code, prog_code
+
+# Trigger compilation at import, same as the kinematics_numba kernels, so
+# the first frame after a cold deploy doesn't pay the JIT cost.
+_update_rep_state(90.0, 0, 0, 0.0, 180.0, 0.0, 0, 0.0, 0, 0.0, 30, 1.0)
+
+# The PoseLandmark enum values never change at runtime, so resolve the
+# role -> index maps for both sides once at import. Enum attribute access
+# goes through __getattr__ and is surprisingly costly on a hot path.
+LANDMARK_INDICES = {
+  side: {role: getattr(mp_pose.PoseLandmark, f"{side.upper()}_{role}").value
+         for role in ("HIP", "SHOULDER", "ELBOW", "WRIST", "KNEE", "ANKLE", "FOOT_INDEX", "INDEX")}
+  for side in ("left", "right")
+}
 
 def get_landmark_indices(side: str):
-  is_left = side == "left"
-  return {"HIP": mp_pose.PoseLandmark.LEFT_HIP.value if is_left else mp_pose.PoseLandmark.RIGHT_HIP.value, "SHOULDER": mp_pose.PoseLandmark.LEFT_SHOULDER.value if is_left else mp_pose.PoseLandmark.RIGHT_SHOULDER.value, "ELBOW": mp_pose.PoseLandmark.LEFT_ELBOW.value if is_left else mp_pose.PoseLandmark.RIGHT_ELBOW.value, "WRIST": mp_pose.PoseLandmark.LEFT_WRIST.value if is_left else mp_pose.PoseLandmark.RIGHT_WRIST.value, "KNEE": mp_pose.PoseLandmark.LEFT_KNEE.value if is_left else mp_pose.PoseLandmark.RIGHT_KNEE.value, "ANKLE": mp_pose.PoseLandmark.LEFT_ANKLE.value if is_left else mp_pose.PoseLandmark.RIGHT_ANKLE.value, "FOOT_INDEX": mp_pose.PoseLandmark.LEFT_FOOT_INDEX.value if is_left else mp_pose.PoseLandmark.RIGHT_FOOT_INDEX.value, "INDEX": mp_pose.PoseLandmark.LEFT_INDEX.value if is_left else mp_pose.PoseLandmark.RIGHT_INDEX.value,}
+  return LANDMARK_INDICES[side]
 
 # =========================================================================
-# 4. EXERCISE ANALYSIS FUNCTIONS (Unchanged)
+# 4. EXERCISE ANALYSIS
 # =========================================================================
-def analyze_shoulder_flexion(landmarks, side: str):
-  indices = get_landmark_indices(side)
-  LM_HIP, LM_SHOULDER, LM_ELBOW = indices["HIP"], indices["SHOULDER"], indices["ELBOW"]
-  if landmarks[LM_HIP].visibility < 0.5 or landmarks[LM_SHOULDER].visibility < 0.5 or landmarks[LM_ELBOW].visibility < 0.5: return 0, {}, [{"type": "warning", "message": f"Low visibility for {side} shoulder/hip/elbow."}]
-  P_HIP, P_SHOULDER, P_ELBOW = [landmarks[LM_HIP].x, landmarks[LM_HIP].y], [landmarks[LM_SHOULDER].x, landmarks[LM_SHOULDER].y], [landmarks[LM_ELBOW].x, landmarks[LM_ELBOW].y]
-  angle = calculate_angle_2d(P_HIP, P_SHOULDER, P_ELBOW)
-  angle_coords = {"A": {"x": P_HIP[0], "y": P_HIP[1]}, "B": {"x": P_SHOULDER[0], "y": P_SHOULDER[1]}, "C": {"x": P_ELBOW[0], "y": P_ELBOW[1]},}
-  return angle, angle_coords, []
-def analyze_shoulder_abduction(landmarks, side: str): return analyze_shoulder_flexion(landmarks, side)
-def analyze_shoulder_internal_rotation(landmarks, side: str):
-  indices = get_landmark_indices(side)
-  LM_HIP, LM_ELBOW, LM_WRIST = indices["HIP"], indices["ELBOW"], indices["WRIST"]
-  if landmarks[LM_HIP].visibility < 0.5 or landmarks[LM_ELBOW].visibility < 0.5 or landmarks[LM_WRIST].visibility < 0.5: return 0, {}, [{"type": "warning", "message": f"Low visibility for {side} shoulder/elbow/wrist."}]
-  P_HIP, P_ELBOW, P_WRIST = [landmarks[LM_HIP].x, landmarks[LM_HIP].y], [landmarks[LM_ELBOW].x, landmarks[LM_ELBOW].y], [landmarks[LM_WRIST].x, landmarks[LM_WRIST].y]
-  angle = calculate_angle_2d(P_HIP, P_ELBOW, P_WRIST)
-  angle_coords = {"A": {"x": P_HIP[0], "y": P_HIP[1]}, "B": {"x": P_ELBOW[0], "y": P_ELBOW[1]}, "C": {"x": P_WRIST[0], "y": P_WRIST[1]},}
-  return angle, angle_coords, []
-def analyze_elbow_flexion(landmarks, side: str):
-  indices = get_landmark_indices(side)
-  LM_SHOULDER, LM_ELBOW, LM_WRIST = indices["SHOULDER"], indices["ELBOW"], indices["WRIST"]
-  if landmarks[LM_SHOULDER].visibility < 0.5 or landmarks[LM_ELBOW].visibility < 0.5 or landmarks[LM_WRIST].visibility < 0.5: return 0, {}, [{"type": "warning", "message": f"Low visibility for {side} elbow/wrist/shoulder."}]
-  P_SHOULDER, P_ELBOW, P_WRIST = [landmarks[LM_SHOULDER].x, landmarks[LM_SHOULDER].y], [landmarks[LM_ELBOW].x, landmarks[LM_ELBOW].y], [landmarks[LM_WRIST].x, landmarks[LM_WRIST].y]
-  angle = calculate_angle_2d(P_SHOULDER, P_ELBOW, P_WRIST)
-  angle_coords = {"A": {"x": P_SHOULDER[0], "y": P_SHOULDER[1]}, "B": {"x": P_ELBOW[0], "y": P_ELBOW[1]}, "C": {"x": P_WRIST[0], "y": P_WRIST[1]},}
-  return angle, angle_coords, []
-def analyze_elbow_extension(landmarks, side: str): return analyze_elbow_flexion(landmarks, side)
-def analyze_knee_flexion(landmarks, side: str):
-  indices = get_landmark_indices(side)
-  LM_HIP, LM_KNEE, LM_ANKLE = indices["HIP"], indices["KNEE"], indices["ANKLE"]
-  if landmarks[LM_HIP].visibility < 0.5 or landmarks[LM_KNEE].visibility < 0.5 or landmarks[LM_ANKLE].visibility < 0.5: return 0, {}, [{"type": "warning", "message": f"Low visibility for {side} hip/knee/ankle."}]
-  P_HIP, P_KNEE, P_ANKLE = [landmarks[LM_HIP].x, landmarks[LM_HIP].y], [landmarks[LM_KNEE].x, landmarks[LM_KNEE].y], [landmarks[LM_ANKLE].x, landmarks[LM_ANKLE].y]
-  angle = calculate_angle_2d(P_HIP, P_KNEE, P_ANKLE)
-  angle_coords = {"A": {"x": P_HIP[0], "y": P_HIP[1]}, "B": {"x": P_KNEE[0], "y": P_KNEE[1]}, "C": {"x": P_ANKLE[0], "y": P_ANKLE[1]},}
-  return angle, angle_coords, []
-def analyze_ankle_dorsiflexion(landmarks, side: str):
-  indices = get_landmark_indices(side)
-  LM_KNEE, LM_ANKLE, LM_FOOT = indices["KNEE"], indices["ANKLE"], indices["FOOT_INDEX"]
-  if landmarks[LM_KNEE].visibility < 0.5 or landmarks[LM_ANKLE].visibility < 0.5 or landmarks[LM_FOOT].visibility < 0.5: return 0, {}, [{"type": "warning", "message": f"Low visibility for {side} knee/ankle/foot."}]
-  P_KNEE, P_ANKLE, P_FOOT = [landmarks[LM_KNEE].x, landmarks[LM_KNEE].y], [landmarks[LM_ANKLE].x, landmarks[LM_ANKLE].y], [landmarks[LM_FOOT].x, landmarks[LM_FOOT].y]
-  angle = calculate_angle_2d(P_KNEE, P_ANKLE, P_FOOT)
-  angle_coords = {"A": {"x": P_KNEE[0], "y": P_KNEE[1]}, "B": {"x": P_ANKLE[0], "y": P_ANKLE[1]}, "C": {"x": P_FOOT[0], "y": P_FOOT[1]},}
-  return angle, angle_coords, []
-def analyze_wrist_flexion(landmarks, side: str):
-  indices = get_landmark_indices(side)
-  LM_ELBOW, LM_WRIST, LM_FINGER = indices["ELBOW"], indices["WRIST"], indices["INDEX"]
-  if landmarks[LM_ELBOW].visibility < 0.5 or landmarks[LM_WRIST].visibility < 0.5 or landmarks[LM_FINGER].visibility < 0.5: return 0, {}, [{"type": "warning", "message": f"Low visibility for {side} elbow/wrist/finger."}]
-  P_ELBOW, P_WRIST, P_FINGER = [landmarks[LM_ELBOW].x, landmarks[LM_ELBOW].y], [landmarks[LM_WRIST].x, landmarks[LM_WRIST].y], [landmarks[LM_FINGER].x, landmarks[LM_FINGER].y]
-  angle = calculate_angle_2d(P_ELBOW, P_WRIST, P_FINGER)
-  angle_coords = {"A": {"x": P_ELBOW[0], "y": P_ELBOW[1]}, "B": {"x": P_WRIST[0], "y": P_WRIST[1]}, "C": {"x": P_FINGER[0], "y": P_FINGER[1]},}
-  return angle, angle_coords, []
-
-ANALYSIS_MAP = {
-  "shoulder flexion": analyze_shoulder_flexion, "shoulder abduction": analyze_shoulder_abduction,
-  "shoulder internal rotation": analyze_shoulder_internal_rotation, "elbow flexion": analyze_elbow_flexion,
-  "elbow extension": analyze_elbow_extension, "knee flexion": analyze_knee_flexion,
-  "ankle dorsiflexion": analyze_ankle_dorsiflexion, "wrist flexion": analyze_wrist_flexion,
+# Each exercise measures one joint angle: (A, B, C) landmark roles with B
+# as the vertex. Resolved against get_landmark_indices(side) per frame.
+EXERCISE_JOINT_TRIPLES = {
+  "shoulder flexion": ("HIP", "SHOULDER", "ELBOW"),
+  "shoulder abduction": ("HIP", "SHOULDER", "ELBOW"),
+  "shoulder internal rotation": ("HIP", "ELBOW", "WRIST"),
+  "elbow flexion": ("SHOULDER", "ELBOW", "WRIST"),
+  "elbow extension": ("SHOULDER", "ELBOW", "WRIST"),
+  "knee flexion": ("HIP", "KNEE", "ANKLE"),
+  "ankle dorsiflexion": ("KNEE", "ANKLE", "FOOT_INDEX"),
+  "wrist flexion": ("ELBOW", "WRIST", "INDEX"),
+}
+
+_ROLE_LABELS = {"HIP": "hip", "SHOULDER": "shoulder", "ELBOW": "elbow", "WRIST": "wrist", "KNEE": "knee", "ANKLE": "ankle", "FOOT_INDEX": "foot", "INDEX": "finger"}
+
+# Index triples and warning labels resolved once per (exercise, side) so the
+# per-frame path does a single dict hit instead of rebuilding the role map.
+EXERCISE_TRIPLE_INDICES = {
+  (name, side): np.array([get_landmark_indices(side)[role] for role in triple], dtype=np.intp)
+  for name, triple in EXERCISE_JOINT_TRIPLES.items() for side in ("left", "right")
 }
+EXERCISE_TRIPLE_LABELS = {name: "/".join(_ROLE_LABELS[role] for role in triple) for name, triple in EXERCISE_JOINT_TRIPLES.items()}
+# Plain-int triples for the jitted kernel alongside the intp array used
+# for the coords gather, resolved with one dict hit.
+EXERCISE_TRIPLE_TABLE = {key: (tuple(map(int, arr)), arr) for key, arr in EXERCISE_TRIPLE_INDICES.items()}
+
+# Low-visibility warnings prebuilt per (exercise, side): the gate is the
+# most common early-out, so it shouldn't format a string or build dicts.
+_LOW_VIS_FEEDBACK = {
+  (name, side): [{"type": "warning", "message": f"Low visibility for {side} {EXERCISE_TRIPLE_LABELS[name]}."}]
+  for name in EXERCISE_JOINT_TRIPLES for side in ("left", "right")
+}
+
+# Fused per-exercise hot-path table: one dict hit yields the two scalars
+# the rep kernel needs, only for exercises that have both a config and an
+# analyzer triple.
+EXERCISE_TABLE = {
+  name: (cfg["calibration_frames"], cfg["debounce"])
+  for name, cfg in EXERCISE_CONFIGS.items() if name in EXERCISE_JOINT_TRIPLES
+}
+
+def landmarks_to_array(landmarks):
+  """One conversion of the 33 landmarks into a (33, 3) float32 [x, y, vis] array."""
+  return np.fromiter((v for lm in landmarks for v in (lm.x, lm.y, lm.visibility)), dtype=np.float32, count=99).reshape(33, 3)
+
+def analyze_exercise(landmarks, exercise_name: str, side: str, pts=None):
+  """Vectorized replacement for the per-exercise analyze_* functions."""
+  (ia, ib, ic), idx = EXERCISE_TRIPLE_TABLE[(exercise_name, side)]
+  if pts is None: pts = landmarks_to_array(landmarks)
+  angle, visible = kinematics_numba.joint_angle(pts, ia, ib, ic, 0.5)
+  if not visible:
+    return 0, [], _LOW_VIS_FEEDBACK[(exercise_name, side)]
+  # Flat [ax, ay, bx, by, cx, cy] — one ravel().tolist() instead of nine
+  # nested dict/key allocations per frame; empty list when absent.
+  return angle, pts[idx, :2].ravel().tolist(), []
+
 # =========================================================================
 # 4. API ENDPOINTS
 # =========================================================================
+@app.on_event("startup")
+async def warm_pose_models():
+  """Runs a dummy inference through every pool worker before serving traffic.
+
+  The graphs allocate their tensors lazily, so without this the first real
+  /api/analyze_frame pays a 1-3 s cold start; warming here also surfaces
+  model-init failures at boot instead of on a patient's first frame.
+  """
+  def _warm():
+    dummy = np.zeros((256, 256, 3), np.uint8)
+    for worker in POSE_POOL:
+      try:
+        worker.detect(dummy)
+      except Exception as e:
+        log.warning(f"pose warm-up failed: {e}")
+  await asyncio.to_thread(_warm)
+
 @app.get("/")
 def root(): return {"message": "AI Physiotherapy API is running", "status": "healthy"}
 
 @app.post("/api/get_plan")
 def get_exercise_plan(request: AilmentRequest):
     ailment = request.ailment.lower()
-    if ailment in EXERCISE_PLANS: return EXERCISE_PLANS[ailment]
+    body = _PLAN_BYTES.get(ailment)
+    if body is not None: return Response(content=body, media_type="application/json")
     raise HTTPException(status_code=404, detail=f"Exercise plan not found for '{ailment}'.")
 
-@app.post("/api/analyze_frame")
-def analyze_frame(request: FrameRequest):
-  # ⚠️ We must rely on the global 'pose' object for performance stability.
-  global pose 
-  
-  reps, stage, last_rep_time = 0, "down", 0
-  angle, angle_coords, feedback, accuracy = 0, {}, [], 0.0
-  DEFAULT_STATE = {"reps": 0, "stage": "down", "last_rep_time": 0, "dynamic_max_angle": 0, "dynamic_min_angle": 180, "frame_count": 0, "partial_rep_buffer": 0.0, "analysis_side": None}
-  
-  current_state = {**DEFAULT_STATE, **(request.previous_state or {})}
-  reps = current_state["reps"]
-  stage = current_state["stage"]
-  last_rep_time = current_state["last_rep_time"]
-  dynamic_max_angle = current_state["dynamic_max_angle"]
-  dynamic_min_angle = current_state["dynamic_min_angle"]
-  frame_count = current_state["frame_count"]
-  partial_rep_buffer = current_state["partial_rep_buffer"]
-  analysis_side = current_state["analysis_side"]
+DEFAULT_STATE = {"reps": 0, "stage": "down", "last_rep_time": 0, "dynamic_max_angle": 0, "dynamic_min_angle": 180, "frame_count": 0, "partial_rep_buffer": 0.0, "calibrated": False, "analysis_side": None}
+
+# Shared fallback payload; consumers only read feedback lists.
+_PROCESSING_FEEDBACK = [{"type": "progress", "message": "Processing..."}]
+
+# Constant feedback dicts, built once and appended by reference; only
+# messages with per-frame values (calibration progress, rep totals) are
+# still formatted on the fly.
+FB_CORRUPT = {"type": "warning", "message": "Video stream data corrupted."}
+FB_NO_MOVEMENT = {"type": "progress", "message": "No movement detected."}
+FB_NO_POSE = {"type": "warning", "message": "No pose detected. Adjust camera view."}
+FB_TURN_SIDEWAYS = {"type": "warning", "message": "Please turn sideways or expose one full side."}
+FB_ANALYSIS_MISSING = {"type": "warning", "message": "Analysis function missing."}
+FB_HOLD_TOP = {"type": "instruction", "message": "Hold contracted position at the top!"}
+FB_GO_DEEPER = {"type": "instruction", "message": "Go deeper for a full rep."}
+FB_SLOW_DOWN = {"type": "warning", "message": "Slow down! Ensure controlled return."}
+FB_PUSH_FURTHER = {"type": "progress", "message": "Push further to the maximum range."}
+FB_RETURN_FULLY = {"type": "progress", "message": "Return fully to the starting position."}
+FB_READY_NEXT = {"type": "progress", "message": "Ready to start the next rep."}
+FB_CONTROLLED_UP = {"type": "progress", "message": "Controlled movement upward."}
+
+# libjpeg-turbo via PyTurboJPEG decodes ~2-4x faster than cv2.imdecode.
+# Optional: needs both the Python package and the system libturbojpeg, so
+# any init failure quietly keeps the cv2 path.
+try:
+  from turbojpeg import TurboJPEG, TJPF_BGR
+  _turbo_jpeg = TurboJPEG()
+except Exception:
+  _turbo_jpeg = None
 
+def _decode_base64_frame(frame_b64: str):
+  """Decodes a (possibly data-URL prefixed) base64 JPEG into a BGR ndarray."""
   try:
-    header, encoded = request.frame.split(',', 1) if ',' in request.frame else ('', request.frame)
+    header, encoded = frame_b64.split(',', 1) if ',' in frame_b64 else ('', frame_b64)
     img_data = base64.b64decode(encoded)
+    if _turbo_jpeg is not None:
+      try:
+        return _turbo_jpeg.decode(img_data, pixel_format=TJPF_BGR)
+      except Exception:
+        pass  # non-JPEG payloads (e.g. PNG data URLs) fall through to cv2
     nparr = np.frombuffer(img_data, np.uint8)
-    frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-    if frame is None or frame.size == 0: 
-      return {"reps": reps, "feedback": [{"type": "warning", "message": "Video stream data corrupted."}], "accuracy_score": 0.0, "state": current_state, "drawing_landmarks": [], "current_angle": 0, "angle_coords": {}}
-
-    image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    results = pose.process(image_rgb)
-    
-    landmarks = None
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+  except Exception:
+    return None
+
+def _corrupt_frame_response(previous_state: Dict | None):
+  current_state = {**DEFAULT_STATE, **(previous_state or {})}
+  return {"reps": current_state["reps"], "feedback": [FB_CORRUPT], "accuracy_score": 0.0, "state": current_state, "drawing_landmarks": [], "current_angle": 0, "angle_coords": []}
+
+# The pose model letterboxes its input to 256x256 internally, so pixels
+# beyond a 256px short side are wasted decode/convert bandwidth. The long
+# edge keeps its own cap for extreme aspect ratios. 0 disables either.
+POSE_INPUT_SHORT_SIDE = int(os.environ.get("POSE_INPUT_SHORT_SIDE", "256"))
+POSE_MAX_EDGE = int(os.environ.get("POSE_MAX_EDGE", "480"))
+
+_resize_buffers = threading.local()
+
+def downscale_frame(frame, max_edge: int = 0):
+  """Caps the frame's long edge; landmark coords are normalized, so no un-projection needed.
+
+  Like bgr_to_rgb, resizes into a per-thread buffer: camera resolution is
+  stable per client, so after the first frame this allocates nothing.
+  """
+  max_edge = max_edge or POSE_MAX_EDGE
+  h, w = frame.shape[:2]
+  scale = 1.0
+  if POSE_INPUT_SHORT_SIDE > 0: scale = min(scale, POSE_INPUT_SHORT_SIDE / min(h, w))
+  if max_edge > 0: scale = min(scale, max_edge / max(h, w))
+  if scale >= 1.0: return frame
+  dsize = (int(w * scale), int(h * scale))
+  buf = getattr(_resize_buffers, "buf", None)
+  if buf is None or buf.shape[:2] != (dsize[1], dsize[0]):
+    buf = np.empty((dsize[1], dsize[0], 3), dtype=frame.dtype)
+    _resize_buffers.buf = buf
+  cv2.resize(frame, dsize, dst=buf, interpolation=cv2.INTER_AREA)
+  return buf
+
+def _detect_in_frame(frame):
+  if frame is None or frame.size == 0: return ("corrupt", None)
+  return ("ok", detect_pose_landmarks(bgr_to_rgb(downscale_frame(frame))))
+
+def analyze_landmarks(landmarks, exercise_name: str, previous_state: Dict | None, include_landmarks: bool = True, pts=None):
+  """Folds one frame's landmarks through the rep-counting state machine.
+
+  ``pts`` is the (33, 3) SoA buffer from landmarks_to_array; callers that
+  already built it pass it in so the landmark list is unboxed exactly once
+  per frame.
+  """
+  reps, stage, last_rep_time = 0, "down", 0
+  angle, angle_coords, feedback, accuracy = 0, [], [], 0.0
+  if pts is None and landmarks is not None: pts = landmarks_to_array(landmarks)
+
+  # Read straight out of previous_state with DEFAULT_STATE's values as
+  # fallbacks instead of materializing a merged dict per frame; the state
+  # is rebuilt as new_state below anyway.
+  state = previous_state or DEFAULT_STATE
+  reps = state.get("reps", 0)
+  stage = state.get("stage", "down")
+  last_rep_time = state.get("last_rep_time", 0)
+  dynamic_max_angle = state.get("dynamic_max_angle", 0)
+  dynamic_min_angle = state.get("dynamic_min_angle", 180)
+  frame_count = state.get("frame_count", 0)
+  partial_rep_buffer = state.get("partial_rep_buffer", 0.0)
+  calibrated = state.get("calibrated", False)
+  analysis_side = state.get("analysis_side")
+
+  if landmarks is None and pts is None:
+    feedback.append(FB_NO_POSE)
+  else:
+    # Clients that send the canonical lower-case name skip the re-casing.
+    if exercise_name not in EXERCISE_TABLE: exercise_name = exercise_name.lower()
+    if analysis_side is None: analysis_side = get_best_side(landmarks, pts=pts)
     
-    if not results.pose_landmarks:
-      feedback.append({"type": "warning", "message": "No pose detected. Adjust camera view."})
+    if analysis_side is None:
+      feedback.append(FB_TURN_SIDEWAYS)
     else:
-      landmarks = results.pose_landmarks.landmark
-      exercise_name = request.exercise_name.lower()
-      if analysis_side is None: analysis_side = get_best_side(landmarks)
-      
-      if analysis_side is None:
-        feedback.append({"type": "warning", "message": "Please turn sideways or expose one full side."})
+      entry = EXERCISE_TABLE.get(exercise_name)
+      if entry is None:
+        if exercise_name not in EXERCISE_CONFIGS: feedback.append({"type": "warning", "message": f"Configuration not found for: {exercise_name}"})
+        else: feedback.append(FB_ANALYSIS_MISSING)
       else:
-        config = EXERCISE_CONFIGS.get(exercise_name, {})
-        if not config: feedback.append({"type": "warning", "message": f"Configuration not found for: {exercise_name}"})
-        else:
-          analysis_func = ANALYSIS_MAP.get(exercise_name)
-          if analysis_func:
-            angle, angle_coords, analysis_feedback = analysis_func(landmarks, analysis_side)
-            feedback.extend(analysis_feedback)
-            
-            if not analysis_feedback:
-              CALIBRATION_FRAMES, DEBOUNCE_TIME = config['calibration_frames'], config['debounce']
-              current_time = time.time()
-              
-              if frame_count < CALIBRATION_FRAMES and reps == 0:
-                dynamic_max_angle = max(dynamic_max_angle, angle)
-                dynamic_min_angle = min(dynamic_min_angle, angle)
-                frame_count += 1
-                feedback.append({"type": "progress", "message": f"Calibrating range ({frame_count}/{CALIBRATION_FRAMES}). Move fully from start to finish position."})
-                accuracy = 0.0
-                
-              if frame_count >= CALIBRATION_FRAMES or reps > 0:
-                CALIBRATED_MIN_ANGLE, CALIBRATED_MAX_ANGLE = dynamic_min_angle, dynamic_max_angle
-                MIN_ANGLE_THRESHOLD_FULL, MAX_ANGLE_THRESHOLD_FULL = CALIBRATED_MIN_ANGLE + 5, CALIBRATED_MAX_ANGLE - 5
-                MIN_ANGLE_THRESHOLD_PARTIAL, MAX_ANGLE_THRESHOLD_PARTIAL = CALIBRATED_MIN_ANGLE + 20, CALIBRATED_MAX_ANGLE - 20
-                frame_accuracy = calculate_accuracy(angle, CALIBRATED_MIN_ANGLE, CALIBRATED_MAX_ANGLE)
-                accuracy = frame_accuracy
-
-                if angle < MIN_ANGLE_THRESHOLD_PARTIAL:
-                  stage = "up"
-                  feedback.append({"type": "instruction", "message": "Hold contracted position at the top!" if angle < MIN_ANGLE_THRESHOLD_FULL else "Go deeper for a full rep."})
-                
-                if angle > MAX_ANGLE_THRESHOLD_PARTIAL and stage == "up":
-                  if current_time - last_rep_time > DEBOUNCE_TIME:
-                    rep_amount = 0.0
-                    if angle > MAX_ANGLE_THRESHOLD_FULL: rep_amount, success_message = 1.0, "FULL Rep Completed! Well done."
-                    else: rep_amount, success_message = 0.5, "Partial Rep (50%) counted. Complete the movement."
-                      
-                    if rep_amount > 0:
-                      stage, partial_rep_buffer, last_rep_time = "down", partial_rep_buffer + rep_amount, current_time
-                      if partial_rep_buffer >= 1.0: reps, partial_rep_buffer = reps + int(partial_rep_buffer), partial_rep_buffer % 1.0
-                      feedback.append({"type": "encouragement", "message": f"{success_message} Total reps: {reps}"})
-                    else: feedback.append({"type": "warning", "message": "Incomplete return to starting position."})
-                  else: feedback.append({"type": "warning", "message": "Slow down! Ensure controlled return."})
-                  
-                if not any(f['type'] in ['warning', 'instruction', 'encouragement'] for f in feedback):
-                  if stage == 'up' and angle > MIN_ANGLE_THRESHOLD_FULL: feedback.append({"type": "progress", "message": "Push further to the maximum range."})
-                  elif stage == 'down' and angle < MAX_ANGLE_THRESHOLD_FULL: feedback.append({"type": "progress", "message": "Return fully to the starting position."})
-                  elif stage == 'down': feedback.append({"type": "progress", "message": "Ready to start the next rep."})
-                  elif stage == 'up': feedback.append({"type": "progress", "message": "Controlled movement upward."})
-          else: feedback.append({"type": "warning", "message": "Analysis function missing."})
-    
-    final_accuracy_display = accuracy
-    drawing_landmarks = get_2d_landmarks(landmarks) if landmarks else []
-    new_state = {"reps": reps, "stage": stage, "angle": round(angle, 1), "last_rep_time": last_rep_time, "dynamic_max_angle": dynamic_max_angle, "dynamic_min_angle": dynamic_min_angle, "frame_count": frame_count, "partial_rep_buffer": partial_rep_buffer, "analysis_side": analysis_side}
-
-    return {"reps": reps, "feedback": feedback if feedback else [{"type": "progress", "message": "Processing..."}], "accuracy_score": round(final_accuracy_display, 2), "state": new_state, "drawing_landmarks": drawing_landmarks, "current_angle": round(angle, 1), "angle_coords": angle_coords, "min_angle": round(dynamic_min_angle, 1), "max_angle": round(dynamic_max_angle, 1), "side": analysis_side}
+        angle, angle_coords, analysis_feedback = analyze_exercise(landmarks, exercise_name, analysis_side, pts=pts)
+        feedback.extend(analysis_feedback)
+
+        if not analysis_feedback:
+          CALIBRATION_FRAMES, DEBOUNCE_TIME = entry
+          current_time = time.time()
+
+          (reps, stage_up, last_rep_time, dynamic_min_angle, dynamic_max_angle, frame_count,
+           partial_rep_buffer, calibrated, accuracy, calibrating, instr_code, rep_code, prog_code) = _update_rep_state(
+              float(angle), int(reps), 1 if stage == "up" else 0, float(last_rep_time),
+              float(dynamic_min_angle), float(dynamic_max_angle), int(frame_count),
+              float(partial_rep_buffer), 1 if calibrated else 0, current_time, int(CALIBRATION_FRAMES), float(DEBOUNCE_TIME))
+          stage = "up" if stage_up else "down"
+          calibrated = bool(calibrated)
+
+          if calibrating:
+            feedback.append({"type": "progress", "message": f"Calibrating range ({frame_count}/{CALIBRATION_FRAMES}). Move fully from start to finish position."})
+          if instr_code:
+            feedback.append(FB_HOLD_TOP if instr_code == 1 else FB_GO_DEEPER)
+          if rep_code == 1: feedback.append({"type": "encouragement", "message": f"FULL Rep Completed! Well done. Total reps: {reps}"})
+          elif rep_code == 2: feedback.append({"type": "encouragement", "message": f"Partial Rep (50%) counted. Complete the movement. Total reps: {reps}"})
+          elif rep_code == 3: feedback.append(FB_SLOW_DOWN)
+          if prog_code == 1: feedback.append(FB_PUSH_FURTHER)
+          elif prog_code == 2: feedback.append(FB_RETURN_FULLY)
+          elif prog_code == 3: feedback.append(FB_READY_NEXT)
+          elif prog_code == 4: feedback.append(FB_CONTROLLED_UP)
+  
+  drawing_landmarks = get_2d_landmarks(landmarks, pts) if (pts is not None and include_landmarks) else []
+  angle_rounded = round(angle, 1)
+  new_state = {"reps": reps, "stage": stage, "angle": angle_rounded, "last_rep_time": last_rep_time, "dynamic_max_angle": dynamic_max_angle, "dynamic_min_angle": dynamic_min_angle, "frame_count": frame_count, "partial_rep_buffer": partial_rep_buffer, "calibrated": calibrated, "analysis_side": analysis_side}
+
+  return {"reps": reps, "feedback": feedback if feedback else _PROCESSING_FEEDBACK, "accuracy_score": round(accuracy, 2), "state": new_state, "drawing_landmarks": drawing_landmarks, "current_angle": angle_rounded, "angle_coords": angle_coords, "min_angle": round(dynamic_min_angle, 1), "max_angle": round(dynamic_max_angle, 1), "side": analysis_side}
+
+# MediaPipe's own detector-tracker pattern: infer on a padded crop around
+# the previous frame's landmarks and only re-detect full-frame when the
+# track degrades (mean visibility below the re-trigger threshold).
+TRACK_ROI_ENABLED = os.environ.get("POSE_TRACK_ROI", "1") == "1"
+# Run inference only every Nth frame on a stable track, reusing the last
+# landmarks in between (same idea as MediaPipe's run-the-detector-only-
+# when-needed gate). Off by default: frozen landmarks delay rep detection
+# at low client frame rates, so this is a deliberate opt-in for streams
+# fast enough to hide it.
+POSE_SKIP_FRAMES = int(os.environ.get("POSE_SKIP_FRAMES", "0"))
+TRACK_ROI_PADDING = 0.2
+TRACK_MIN_VISIBILITY = 0.5
+TRACK_MIN_CROP_PX = 64
+
+def _detect_in_roi(frame, bbox):
+  """Runs pose on a padded crop; returns un-projected landmarks or None on a lost track."""
+  h, w = frame.shape[:2]
+  x0, y0, x1, y1 = bbox
+  pad_x, pad_y = (x1 - x0) * TRACK_ROI_PADDING, (y1 - y0) * TRACK_ROI_PADDING
+  cx0, cy0 = max(0, int((x0 - pad_x) * w)), max(0, int((y0 - pad_y) * h))
+  cx1, cy1 = min(w, int((x1 + pad_x) * w)), min(h, int((y1 + pad_y) * h))
+  if cx1 - cx0 < TRACK_MIN_CROP_PX or cy1 - cy0 < TRACK_MIN_CROP_PX: return None
+  crop = np.ascontiguousarray(frame[cy0:cy1, cx0:cx1])
+  landmarks = detect_pose_landmarks(bgr_to_rgb(crop))
+  if landmarks is None: return None
+  if sum(lm.visibility for lm in landmarks) / len(landmarks) < TRACK_MIN_VISIBILITY: return None
+  sx, sy, ox, oy = (cx1 - cx0) / w, (cy1 - cy0) / h, cx0 / w, cy0 / h
+  for lm in landmarks:
+    lm.x = ox + lm.x * sx
+    lm.y = oy + lm.y * sy
+  return landmarks
+
+# Stalled cameras (common on mobile) re-send identical frames; a 64-bit
+# dHash spots them for the cost of a 9x8 resize, skipping inference.
+FRAME_DEDUP_ENABLED = os.environ.get("POSE_FRAME_DEDUP", "1") == "1"
+
+def _frame_dhash(frame) -> str:
+  small = cv2.resize(frame, (9, 8), interpolation=cv2.INTER_AREA)
+  gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+  # Hex string, not int: the hash rides in the state dict that REST
+  # clients echo back as JSON, and JavaScript numbers lose integer
+  # precision above 2^53, which would break the equality check.
+  return np.packbits(gray[:, 1:] > gray[:, :-1]).tobytes().hex()
+
+def _duplicate_frame_response(previous_state: Dict | None):
+  current_state = {**DEFAULT_STATE, **(previous_state or {})}
+  return {"reps": current_state["reps"], "feedback": [FB_NO_MOVEMENT], "accuracy_score": 0.0, "state": current_state, "drawing_landmarks": [], "current_angle": current_state.get("angle", 0), "angle_coords": [], "min_angle": round(current_state["dynamic_min_angle"], 1), "max_angle": round(current_state["dynamic_max_angle"], 1), "side": current_state["analysis_side"]}
+
+def _landmark_bbox(pts):
+  x0, y0 = pts[:, :2].min(axis=0)
+  x1, y1 = pts[:, :2].max(axis=0)
+  return [max(0.0, float(x0)), max(0.0, float(y0)), min(1.0, float(x1)), min(1.0, float(y1))]
+
+def analyze_decoded_frame(frame, exercise_name: str, previous_state: Dict | None, include_landmarks: bool = True):
+  """Decoded-BGR entry point shared by the REST route and batch path."""
+  if frame is None or frame.size == 0:
+    return _corrupt_frame_response(previous_state)
+  frame = downscale_frame(frame)
+  frame_hash = _frame_dhash(frame) if FRAME_DEDUP_ENABLED else None
+  if frame_hash is not None and (previous_state or {}).get("frame_hash") == frame_hash:
+    return _duplicate_frame_response(previous_state)
+  state = previous_state or {}
+  landmarks, pts, reused = None, None, False
+  seq = state.get("frame_seq", 0)
+  if (POSE_SKIP_FRAMES > 1 and seq % POSE_SKIP_FRAMES != 0
+      and state.get("last_pts") is not None and state.get("last_conf", 0.0) > TRACK_MIN_VISIBILITY):
+    # Stable track: reuse the previous landmarks and skip inference
+    # entirely — angles move slowly relative to the frame rate.
+    pts = np.asarray(state["last_pts"], dtype=np.float32)
+    reused = True
+  else:
+    bbox = state.get("track_bbox")
+    if TRACK_ROI_ENABLED and bbox:
+      landmarks = _detect_in_roi(frame, bbox)
+    if landmarks is None:
+      landmarks = detect_pose_landmarks(bgr_to_rgb(frame))
+    pts = landmarks_to_array(landmarks) if landmarks is not None else None
+  result = analyze_landmarks(landmarks, exercise_name, previous_state, include_landmarks, pts=pts)
+  if TRACK_ROI_ENABLED and not reused:
+    result["state"]["track_bbox"] = _landmark_bbox(pts) if pts is not None else None
+  if POSE_SKIP_FRAMES > 1:
+    result["state"]["frame_seq"] = seq + 1
+    result["state"]["last_pts"] = pts.tolist() if pts is not None else None
+    result["state"]["last_conf"] = float(pts[:, 2].mean()) if pts is not None else 0.0
+  if frame_hash is not None:
+    result["state"]["frame_hash"] = frame_hash
+  return result
+
+# Server-side rep-counting state for REST clients that send a session_id:
+# saves re-parsing (and re-serializing) the state dict on every frame.
+# Bounded with the same oldest-first eviction as active_chats.
+FRAME_SESSION_STATES: Dict[str, Dict] = {}
+MAX_FRAME_SESSIONS = 500
+
+def _fresher_state(cached: Dict | None, client: Dict | None):
+  """Picks the more advanced of the server-cached and client-echoed states.
+
+  With several gunicorn workers and no sticky routing, consecutive frames
+  for one session_id can land on workers whose caches lag each other. The
+  client's echoed state is the only copy that saw every response, so the
+  state that has progressed further (reps plus partial-rep credit, then
+  calibration frames) wins — the rep count never flaps backwards.
+  """
+  if cached is None: return client
+  if client is None: return cached
+  cached_key = (cached.get("reps", 0) + cached.get("partial_rep_buffer", 0.0), cached.get("frame_count", 0))
+  client_key = (client.get("reps", 0) + client.get("partial_rep_buffer", 0.0), client.get("frame_count", 0))
+  return cached if cached_key >= client_key else client
 
+@app.post("/api/analyze_frame")
+async def analyze_frame(request: FrameRequest):
+  # Everything CPU-heavy goes through the one bounded _frame_executor:
+  # concurrent requests queue onto it and spread across the pose pool
+  # instead of fanning out over FastAPI's default (much larger) threadpool
+  # and oversubscribing the graphs. MediaPipe has no true batch mode, so
+  # cross-request "batching" is this bounded parallel dispatch.
+  loop = asyncio.get_running_loop()
+  previous_state = request.previous_state
+  if request.session_id is not None:
+    previous_state = _fresher_state(FRAME_SESSION_STATES.get(request.session_id), previous_state)
+  try:
+    if request.frames:
+      # Decode and infer in parallel across the worker pool, then fold the
+      # rep-counting state sequentially so rep order is preserved.
+      frames = await asyncio.gather(*[loop.run_in_executor(_frame_executor, _decode_base64_frame, f) for f in request.frames])
+      detections = await asyncio.gather(*[loop.run_in_executor(_frame_executor, _detect_in_frame, f) for f in frames])
+      state, result = previous_state, None
+      for tag, landmarks in detections:
+        result = _corrupt_frame_response(state) if tag == "corrupt" else analyze_landmarks(landmarks, request.exercise_name, state, request.include_landmarks)
+        state = result["state"]
+      if result is None: result = _corrupt_frame_response(state)
+    else:
+      result = await loop.run_in_executor(
+          _frame_executor,
+          lambda: analyze_decoded_frame(_decode_base64_frame(request.frame), request.exercise_name, previous_state, request.include_landmarks))
+    if request.session_id is not None:
+      if request.session_id not in FRAME_SESSION_STATES and len(FRAME_SESSION_STATES) >= MAX_FRAME_SESSIONS:
+        FRAME_SESSION_STATES.pop(next(iter(FRAME_SESSION_STATES)))
+      FRAME_SESSION_STATES[request.session_id] = result["state"]
+    return result
   except Exception as e:
     # Crucial for catching the intermittent MediaPipe timestamp error 
     # and preventing the server from crashing into a 502 error state.
     error_detail = str(e)
     if "Packet timestamp mismatch" in error_detail or "CalculatorGraph::Run() failed" in error_detail:
-      print(f"Handled MediaPipe Timestamp Error: {error_detail}")
+      log.warning(f"Handled MediaPipe Timestamp Error: {error_detail}")
       # Return a temporary error message that allows the client to retry
       raise HTTPException(status_code=400, detail="Transient analysis error. Please try again.")
-    
-    print(f"CRITICAL ERROR in analyze_frame: {error_detail}")
-    traceback.print_exc()
+
+    log.exception(f"CRITICAL ERROR in analyze_frame: {error_detail}")
     raise HTTPException(status_code=500, detail=f"Unexpected server error during analysis: {error_detail}")
-  # 🚫 NO 'finally: pose.close()' because the 'pose' object is global
+
+@app.websocket("/ws/analyze")
+async def analyze_stream(websocket: WebSocket):
+  """Streams raw frames, skipping the base64 + JPEG decode of the REST route.
+
+  Binary messages carry one frame as [uint16 w][uint16 h][raw BGR bytes]
+  (little-endian header). Text messages are JSON control frames, e.g.
+  {"exercise_name": "elbow flexion"} or {"reset": true}. The rep-counting
+  state lives on the connection, so clients no longer round-trip
+  previous_state on every frame.
+  """
+  await websocket.accept()
+  exercise_name = ""
+  include_landmarks = True
+  state: Dict | None = None
+  try:
+    while True:
+      message = await websocket.receive()
+      if message["type"] == "websocket.disconnect": break
+      if message.get("text") is not None:
+        try:
+          params = _json_loads(message["text"])
+        except ValueError:
+          await websocket.send_json({"error": "Control frames must be JSON."})
+          continue
+        exercise_name = params.get("exercise_name", exercise_name)
+        include_landmarks = params.get("include_landmarks", include_landmarks)
+        if params.get("reset"): state = None
+        continue
+      data = message.get("bytes")
+      if not data: continue
+      if len(data) < 4:
+        await websocket.send_json({"error": "Frame header missing."})
+        continue
+      w, h = struct.unpack_from("<HH", data)
+      if len(data) != 4 + w * h * 3:
+        await websocket.send_json({"error": f"Expected {4 + w * h * 3} bytes for a {w}x{h} BGR frame."})
+        continue
+      frame = np.frombuffer(data, np.uint8, count=w * h * 3, offset=4).reshape(h, w, 3)
+      result = await run_in_threadpool(analyze_decoded_frame, frame, exercise_name, state, include_landmarks)
+      state = result["state"]
+      await websocket.send_text(_json_dumps(result))
+  except WebSocketDisconnect:
+    pass
 
 # =========================================================================
 # 5. API ENDPOINTS (Authentication, Session & Progress)
@@ -350,7 +937,7 @@ def analyze_frame(request: FrameRequest):
 @app.post("/api/auth/signup")
 async def signup(credentials: UserCredentials):
     try:
-        res = supabase.auth.sign_up({"email": credentials.email, "password": credentials.password})
+        res = await asyncio.to_thread(get_supabase_client().auth.sign_up, {"email": credentials.email, "password": credentials.password})
         if res.user is None and res.session is None:
             raise HTTPException(status_code=400, detail="Could not sign up user.")
         return {"message": "Signup successful! Check email to verify.", "user_id": res.user.id}
@@ -362,13 +949,78 @@ async def signup(credentials: UserCredentials):
 @app.post("/api/auth/signin")
 async def signin(credentials: UserCredentials):
     try:
-        res = supabase.auth.sign_in_with_password({"email": credentials.email, "password": credentials.password})
+        res = await asyncio.to_thread(get_supabase_client().auth.sign_in_with_password, {"email": credentials.email, "password": credentials.password})
         return {"message": "Signin successful!", "access_token": res.session.access_token, "user_id": res.user.id}
     except AuthApiError:
         raise HTTPException(status_code=401, detail="Invalid login credentials")
     except Exception as e:
         raise HTTPException(status_code=500, detail="An internal server error occurred.")
 
+# Session inserts are batched off the request path: save_session enqueues
+# and returns immediately, and a background task flushes up to 100 records
+# per 250 ms window in one insert. Trade-off (accepted): up to one window
+# of unflushed sessions is lost on a crash. SESSION_WRITE_BATCH=0 restores
+# the synchronous per-request insert.
+SESSION_WRITE_BATCH = os.environ.get("SESSION_WRITE_BATCH", "1") == "1"
+_session_write_queue: asyncio.Queue = asyncio.Queue(maxsize=1000)
+_SESSION_FLUSH_MAX_BATCH = 100
+_SESSION_FLUSH_WINDOW_SECONDS = 0.25
+
+async def _flush_session_batch(batch):
+    try:
+        await asyncio.to_thread(get_supabase_client().table("user_sessions").insert(batch).execute)
+    except Exception:
+        log.exception(f"Batched session insert failed; {len(batch)} record(s) lost.")
+        return
+    # Invalidate only once the rows have landed: popping at enqueue time
+    # let a progress read in the flush window re-cache the stale
+    # aggregate for a full TTL.
+    for record in batch:
+        _progress_cache.pop(record["user_id"], None)
+
+async def _session_write_flusher():
+    loop = asyncio.get_running_loop()
+    batch = []
+    try:
+        while True:
+            batch = [await _session_write_queue.get()]
+            deadline = loop.time() + _SESSION_FLUSH_WINDOW_SECONDS
+            while len(batch) < _SESSION_FLUSH_MAX_BATCH:
+                remaining = deadline - loop.time()
+                if remaining <= 0: break
+                try:
+                    batch.append(await asyncio.wait_for(_session_write_queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            pending, batch = batch, []
+            await _flush_session_batch(pending)
+    except asyncio.CancelledError:
+        # Shutdown: write out whatever was dequeued but not yet flushed.
+        if batch:
+            await _flush_session_batch(batch)
+        raise
+
+@app.on_event("startup")
+async def start_session_flusher():
+    if SESSION_WRITE_BATCH:
+        app.state.session_flusher = asyncio.create_task(_session_write_flusher())
+
+@app.on_event("shutdown")
+async def drain_session_queue():
+    if not SESSION_WRITE_BATCH: return
+    # Await the cancelled task so its in-flight batch is flushed before
+    # the leftover queue is drained below.
+    app.state.session_flusher.cancel()
+    try:
+        await app.state.session_flusher
+    except asyncio.CancelledError:
+        pass
+    batch = []
+    while not _session_write_queue.empty():
+        batch.append(_session_write_queue.get_nowait())
+    if batch:
+        await _flush_session_batch(batch)
+
 @app.post("/api/save_session")
 async def save_session(data: SessionData):
     try:
@@ -379,78 +1031,145 @@ async def save_session(data: SessionData):
             "accuracy_score": data.accuracy_score,
             "session_date": dt.now().strftime("%Y-%m-%d"),
         }
-        supabase.table("user_sessions").insert([session_record]).execute()
+        if SESSION_WRITE_BATCH:
+            try:
+                # The flusher invalidates _progress_cache after the batch
+                # insert lands, so no pop here.
+                _session_write_queue.put_nowait(session_record)
+            except asyncio.QueueFull:
+                # Back-pressure path: fall through to a direct write.
+                await asyncio.to_thread(get_supabase_client().table("user_sessions").insert([session_record]).execute)
+                _progress_cache.pop(data.user_id, None)
+        else:
+            # The query builder is cheap; only .execute() does network I/O, so
+            # that is what gets pushed off the event loop.
+            await asyncio.to_thread(get_supabase_client().table("user_sessions").insert([session_record]).execute)
+            _progress_cache.pop(data.user_id, None)
         return {"message": "Session saved successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Server error during session save: {str(e)}")
 
 
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+# Assembled progress responses cached per user. The write path pops the
+# writer's entry once the insert has landed (in _flush_session_batch for
+# batched writes) so local reads stay fresh; the TTL bounds staleness
+# from other gunicorn workers writing to the same user. Keeping Supabase as
+# the single source of truth (rather than maintaining running aggregates
+# in-process) avoids drift between workers.
+_progress_cache: Dict[str, Tuple[float, Dict]] = {}
+PROGRESS_CACHE_TTL_SECONDS = 60
+MAX_PROGRESS_CACHE_USERS = 500
+
+# Emails effectively never change, so this lookup cache sits in front of
+# the auth.users query for the dashboard's lifetime in each worker.
+_user_email_cache: Dict[str, str] = {}
+
+async def _get_patient_email(user_id: str) -> str:
+    email = _user_email_cache.get(user_id)
+    if email is not None:
+        return email
+    email = "Not Found"
+    try:
+        # Note: This query requires RLS policies on `auth.users` to be configured
+        # to allow service roles to read the email column.
+        user_data_res = await asyncio.to_thread(get_supabase_client().from_("users").select("email").eq("id", user_id).single().execute)
+        if user_data_res.data:
+            email = user_data_res.data.get("email", "Not Found")
+    except Exception:
+        log.warning(f"Could not fetch email for user_id: {user_id}. Check RLS on auth.users.")
+        return email  # don't cache failures
+    if len(_user_email_cache) >= MAX_PROGRESS_CACHE_USERS:
+        _user_email_cache.pop(next(iter(_user_email_cache)))
+    _user_email_cache[user_id] = email
+    return email
+
+# Latched False after the first failed call: the RPC has to be applied
+# by hand from sql/get_user_weekly_progress.sql, and when it isn't,
+# probing it per request adds a guaranteed failing network round-trip in
+# front of the pandas fallback. A worker restart re-probes.
+_weekly_rpc_available = True
+
+def _fetch_weekly_progress_rpc(user_id: str):
+    """7-row weekly aggregate computed in Postgres (see sql/get_user_weekly_progress.sql).
+
+    Returns None when the RPC is not installed so callers can fall back to
+    aggregating in Python.
+    """
+    global _weekly_rpc_available
+    if not _weekly_rpc_available:
+        return None
+    try:
+        rpc_res = get_supabase_client().rpc("get_user_weekly_progress", {"p_user_id": user_id}).execute()
+        if not rpc_res.data:
+            return None
+        by_day = {row["day"]: row for row in rpc_res.data}
+        return [{"day": day, "reps": int(by_day[day]["reps"]) if day in by_day else 0,
+                 "accuracy": round(float(by_day[day]["accuracy"]), 1) if day in by_day else 0.0}
+                for day in WEEKDAYS]
+    except Exception:
+        _weekly_rpc_available = False
+        log.info("Weekly progress RPC unavailable; aggregating in Python from now on.")
+        return None
+
 @app.get("/api/progress/{user_id}")
 async def get_progress(user_id: str):
     """Fetches and aggregates progress data, adding patient and injury context."""
+    cached = _progress_cache.get(user_id)
+    if cached is not None and time.time() - cached[0] < PROGRESS_CACHE_TTL_SECONDS:
+        return cached[1]
     try:
         # Fetch Patient Details (Email)
-        patient_email = "Not Found"
-        try:
-            # Note: This query requires RLS policies on `auth.users` to be configured
-            # to allow service roles to read the email column.
-            user_data_res = supabase.from_("users").select("email").eq("id", user_id).single().execute()
-            if user_data_res.data:
-                patient_email = user_data_res.data.get("email", "Not Found")
-        except Exception:
-            print(f"Could not fetch email for user_id: {user_id}. Check RLS on auth.users.")
+        patient_email = await _get_patient_email(user_id)
 
         # Fetch Session Data
-        sessions_res = supabase.table("user_sessions")\
-            .select("exercise_name, reps_completed, accuracy_score, created_at, session_date")\
-            .eq("user_id", user_id)\
-            .order("created_at", desc=True)\
-            .execute()
+        sessions_res = await asyncio.to_thread(
+            get_supabase_client().table("user_sessions")
+            .select("exercise_name, reps_completed, accuracy_score, created_at, session_date")
+            .eq("user_id", user_id)
+            .order("created_at", desc=True)
+            .execute)
         sessions = sessions_res.data
 
         if not sessions:
             return {
                 "user_id": user_id, "patient_email": patient_email, "treated_ailment": "No sessions recorded",
                 "total_sessions": 0, "total_reps": 0, "average_accuracy": 0.0,
-                "weekly_data": [{"day": day, "reps": 0, "accuracy": 0.0} for day in ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]],
+                "weekly_data": [{"day": day, "reps": 0, "accuracy": 0.0} for day in WEEKDAYS],
                 "recent_sessions": []
             }
 
+        # Columnar aggregation: C-level sums/groupby instead of per-row
+        # Python loops once a user accumulates real history.
+        df = pd.DataFrame(sessions)
+
         # Determine Treated Ailment
-        performed_exercises = {s['exercise_name'].lower() for s in sessions}
+        performed_exercises = set(df['exercise_name'].str.lower())
         ailment_scores = {}
         for plan_name, plan_details in EXERCISE_PLANS.items():
             plan_exercises = {ex['name'].lower() for ex in plan_details['exercises']}
             matches = len(performed_exercises.intersection(plan_exercises))
             if matches > 0:
                 ailment_scores[plan_details['ailment']] = matches
-        
+
         treated_ailment = max(ailment_scores, key=ailment_scores.get) if ailment_scores else "General Fitness"
 
         # Aggregate Stats & FIX Accuracy (Assume DB stores 0-100)
         total_sessions = len(sessions)
-        total_reps = sum(s['reps_completed'] for s in sessions)
-        total_weighted_accuracy = sum(s['reps_completed'] * s['accuracy_score'] for s in sessions)
+        total_reps = int(df['reps_completed'].sum())
+        total_weighted_accuracy = float((df['reps_completed'] * df['accuracy_score']).sum())
         average_accuracy = total_weighted_accuracy / total_reps if total_reps > 0 else 0.0
 
-        weekly_map = {day: {"reps": 0, "accuracy_sum": 0, "count": 0} for day in ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]}
-        for session in sessions:
-            try:
-                date_obj = dt.fromisoformat(session['created_at'].replace('Z', '+00:00'))
-                day_name = date_obj.strftime('%a')
-                if day_name in weekly_map:
-                    weekly_map[day_name]['reps'] += session['reps_completed']
-                    weekly_map[day_name]['accuracy_sum'] += session['accuracy_score']
-                    weekly_map[day_name]['count'] += 1
-            except (ValueError, KeyError, TypeError):
-                continue
-
-        weekly_data = []
-        for day_name in ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]:
-            day_data = weekly_map[day_name]
-            avg_accuracy = round(day_data['accuracy_sum'] / day_data['count'], 1) if day_data['count'] > 0 else 0.0
-            weekly_data.append({"day": day_name, "reps": day_data['reps'], "accuracy": avg_accuracy})
-        
+        weekly_data = await asyncio.to_thread(_fetch_weekly_progress_rpc, user_id)
+        if weekly_data is None:
+            weekday = pd.to_datetime(df['created_at'], errors='coerce', utc=True, format='mixed').dt.weekday
+            agg = df.groupby(weekday).agg(reps=('reps_completed', 'sum'), accuracy=('accuracy_score', 'mean'))
+            weekly_data = [{"day": WEEKDAYS[i],
+                            "reps": int(agg['reps'].get(i, 0)),
+                            "accuracy": round(float(agg['accuracy'].get(i, 0.0)), 1)}
+                           for i in range(7)]
+
         recent_sessions = [
             {
                 "date": s['session_date'],
@@ -460,7 +1179,7 @@ async def get_progress(user_id: str):
             } for s in sessions[:5]
         ]
 
-        return {
+        response = {
             "user_id": user_id,
             "patient_email": patient_email,
             "treated_ailment": treated_ailment.title(),
@@ -470,8 +1189,12 @@ async def get_progress(user_id: str):
             "weekly_data": weekly_data,
             "recent_sessions": recent_sessions
         }
+        if user_id not in _progress_cache and len(_progress_cache) >= MAX_PROGRESS_CACHE_USERS:
+            _progress_cache.pop(next(iter(_progress_cache)))
+        _progress_cache[user_id] = (time.time(), response)
+        return response
     except Exception as e:
-        traceback.print_exc()
+        log.exception("get_progress failed")
         raise HTTPException(status_code=500, detail=f"Server error fetching progress: {str(e)}")
 
 
@@ -682,26 +1405,47 @@ def build_html_content(data: Dict[str, Any]) -> str:
     </html>
     """
 
+# WeasyPrint rendering is by far the slowest operation in the service
+# (hundreds of ms of CSS/layout work), so rendered PDFs are cached in
+# memory keyed on the report's content. The fingerprint covers the
+# progress data and the render date (the header embeds "Generated:
+# <date>"), so a new session or a new day re-renders and anything else
+# is a cache hit.
+_pdf_cache: Dict[str, Tuple[str, bytes]] = {}
+MAX_PDF_CACHE_USERS = 100
+
 @app.get("/api/pdf/{user_id}")
-async def download_pdf_report(user_id: str):
+async def download_pdf_report(user_id: str, request: Request):
     PDF_FILENAME = f"Rebound Report {dt.now().strftime('%Y-%m-%d')}.pdf"
     try:
         data = await get_progress(user_id)
         if not isinstance(data, dict) or data.get("total_sessions") == 0:
             raise HTTPException(status_code=404, detail="No session data to generate a report.")
-        html_content = build_html_content(data)
-        HTML(string=html_content).write_pdf(PDF_FILENAME)
-        headers = {'Content-Disposition': f'attachment; filename="{PDF_FILENAME}"'}
-        return FileResponse(
-            path=PDF_FILENAME,
-            media_type='application/pdf',
-            filename=PDF_FILENAME,
-            headers=headers,
-            background=BackgroundTask(os.remove, PDF_FILENAME)
-        )
+        fingerprint = f"{dt.now().strftime('%Y-%m-%d')}:{_json_dumps(data)}"
+        # The ETag is the fingerprint hash, so a client revalidating an
+        # unchanged report gets a bodyless 304 before we even touch the
+        # render cache.
+        etag = f'"{hashlib.sha1(fingerprint.encode()).hexdigest()}"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        cached = _pdf_cache.get(user_id)
+        if cached is not None and cached[0] == fingerprint:
+            pdf_bytes = cached[1]
+        else:
+            html_content = build_html_content(data)
+            # WeasyPrint layout is pure-Python and takes hundreds of ms;
+            # render in a worker thread so frame analysis keeps flowing
+            # while the report is built.
+            pdf_bytes = await asyncio.to_thread(lambda: HTML(string=html_content).write_pdf())
+            if user_id not in _pdf_cache and len(_pdf_cache) >= MAX_PDF_CACHE_USERS:
+                _pdf_cache.pop(next(iter(_pdf_cache)))
+            _pdf_cache[user_id] = (fingerprint, pdf_bytes)
+        headers = {'Content-Disposition': f'attachment; filename="{PDF_FILENAME}"', 'ETag': etag}
+        return Response(content=pdf_bytes, media_type='application/pdf', headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
-        traceback.print_exc()
-        if os.path.exists(PDF_FILENAME): os.remove(PDF_FILENAME)
+        log.exception("PDF report generation failed")
         raise HTTPException(status_code=500, detail=f"Failed to generate PDF report: {str(e)}")
 
 
@@ -719,34 +1463,127 @@ PREDEFINED_RESPONSES = {
     "how long": "Rehabilitation length varies based on the injury's severity and your body's response. Typical plans are **4-8 weeks**, but consistent, gradual effort is more important than rushing the process.",
 }
 
+class _KeywordAutomaton:
+    """Aho-Corasick automaton over the predefined-response keywords.
+
+    One DFA pass over the message replaces the per-keyword substring
+    scans; ties resolve by PREDEFINED_RESPONSES insertion order, matching
+    the old linear scan exactly.
+    """
+    def __init__(self, keywords):
+        self._goto = [{}]
+        self._out = [[]]
+        for priority, word in enumerate(keywords):
+            node = 0
+            for ch in word:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    self._goto.append({})
+                    self._out.append([])
+                    nxt = len(self._goto) - 1
+                    self._goto[node][ch] = nxt
+                node = nxt
+            self._out[node].append(priority)
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt].extend(self._out[self._fail[nxt]])
+
+    def first_priority_match(self, text: str):
+        node, best = 0, None
+        for ch in text:
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for priority in self._out[node]:
+                if best is None or priority < best:
+                    best = priority
+        return best
+
+_CHAT_KEYWORDS = list(PREDEFINED_RESPONSES)
+_chat_automaton = _KeywordAutomaton(_CHAT_KEYWORDS)
+# Canned replies serialized once, indexed by keyword priority.
+_CHAT_RESPONSE_BYTES = [_json_dumps({"response": PREDEFINED_RESPONSES[k]}).encode() for k in _CHAT_KEYWORDS]
+
+CHAT_SYSTEM_INSTRUCTION = ("You are Mia — a friendly, professional virtual rehabilitation assistant and coach...") # Instruction text omitted for brevity
+CHAT_SESSION_TTL_SECONDS = 3600
+MAX_LOCAL_CHAT_SESSIONS = 500
+
+# Chat history lives in Redis when REDIS_URL is set, so sessions survive
+# restarts and stay consistent across gunicorn workers without sticky
+# routing. Without Redis we keep the (bounded) process-local dict.
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+_redis_client = None
+
+def get_redis_client():
+    global _redis_client
+    redis_url = os.environ.get("REDIS_URL")
+    if aioredis is None or not redis_url:
+        return None
+    if _redis_client is None:
+        _redis_client = aioredis.from_url(redis_url, decode_responses=True)
+    return _redis_client
+
+def _new_chat_session(history=None):
+    return ai_client.chats.create(
+        model=MODEL_NAME,
+        config=GenerateContentConfig(system_instruction=CHAT_SYSTEM_INSTRUCTION),
+        history=history or [],
+    )
+
+async def _load_chat_history(redis_client, session_id: str):
+    from google.genai import types as genai_types
+    raw = await redis_client.get(f"chat:{session_id}")
+    if not raw:
+        return []
+    return [genai_types.Content.model_validate(item) for item in json.loads(raw)]
+
+async def _store_chat_history(redis_client, session_id: str, history):
+    payload = json.dumps([c.model_dump(mode="json", exclude_none=True) for c in history])
+    await redis_client.set(f"chat:{session_id}", payload, ex=CHAT_SESSION_TTL_SECONDS)
+
 @app.post("/api/chat")
 async def chat(request: ChatRequest):
     try:
         user_message = request.message
         session_id = request.session_id
         message_lower = user_message.lower()
-        for keyword, response in PREDEFINED_RESPONSES.items():
-            if keyword in message_lower:
-                return {"response": response}
+        matched = _chat_automaton.first_priority_match(message_lower)
+        if matched is not None:
+            return Response(content=_CHAT_RESPONSE_BYTES[matched], media_type="application/json")
+
+        redis_client = get_redis_client()
+        if redis_client is not None:
+            history = await _load_chat_history(redis_client, session_id)
+            chat_session = _new_chat_session(history)
+            gemini_response = await asyncio.to_thread(chat_session.send_message, user_message)
+            await _store_chat_history(redis_client, session_id, chat_session.get_history())
+            return {"response": gemini_response.text}
 
         if session_id not in active_chats:
-            system_instruction = ("You are Mia — a friendly, professional virtual rehabilitation assistant and coach...") # Instruction text omitted for brevity
-            chat_session = ai_client.chats.create(
-                model=MODEL_NAME,
-                config=GenerateContentConfig(system_instruction=system_instruction)
-            )
-            active_chats[session_id] = chat_session
-            print(f"New chat session created for ID: {session_id}")
-        else:
-            chat_session = active_chats[session_id]
+            if len(active_chats) >= MAX_LOCAL_CHAT_SESSIONS:
+                active_chats.pop(next(iter(active_chats)))
+            active_chats[session_id] = _new_chat_session()
+            log.info(f"New chat session created for ID: {session_id}")
+        chat_session = active_chats[session_id]
 
-        gemini_response = chat_session.send_message(user_message)
+        gemini_response = await asyncio.to_thread(chat_session.send_message, user_message)
         bot_response = gemini_response.text
         return {"response": bot_response}
 
     except Exception as e:
-        print(f"Error in /api/chat: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in /api/chat: {e}")
         raise HTTPException(status_code=500, detail=f"An AI or Server error occurred: {str(e)}")
 
 
@@ -754,7 +1591,7 @@ MODEL_PATH = 'model/cph_model.joblib'
 try:
     CPH_MODEL = joblib.load(MODEL_PATH)
 except FileNotFoundError:
-    print(f"⚠️ WARNING: Model file not found at {MODEL_PATH}. Prediction endpoint will fail.")
+    log.warning(f"Model file not found at {MODEL_PATH}. Prediction endpoint will fail.")
     CPH_MODEL = None
 
 MODEL_FEATURES = [
@@ -794,7 +1631,7 @@ def predict_recovery(data: PredictionInput):
         if injury_column_name in patient_df.columns:
             patient_df.loc[0, injury_column_name] = 1.0
         else:
-            print(f"Warning: Injury type '{injury_column_name}' not found in model features. Using default zero vector.")
+            log.warning(f"Injury type '{injury_column_name}' not found in model features. Using default zero vector.")
         patient_input = patient_df[MODEL_FEATURES]
         median_recovery_time = CPH_MODEL.predict_median(patient_input)
         predicted_days = int(median_recovery_time) # Access first element of numpy array
@@ -803,7 +1640,7 @@ def predict_recovery(data: PredictionInput):
             "median_recovery_days": predicted_days
         }
     except Exception as e:
-        traceback.print_exc()
+        log.exception("predict_recovery failed")
         raise HTTPException(status_code=500, detail=f"Prediction processing failed: {str(e)}")
 
 # =========================================================================
@@ -811,4 +1648,6 @@ def predict_recovery(data: PredictionInput):
 # =========================================================================
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # A single pose graph is effectively single-threaded, so one process
+    # caps analyze throughput at ~1 core; WEB_CONCURRENCY scales it out.
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=int(os.environ.get("WEB_CONCURRENCY", "1")))
@@ -0,0 +1,17 @@
+-- Run once in the Supabase SQL editor.
+-- Pushes the weekly progress aggregation into Postgres so /api/progress
+-- pulls 7 aggregate rows instead of every session row for the user.
+
+create index if not exists idx_user_sessions_user_created
+    on user_sessions (user_id, created_at desc);
+
+create or replace function get_user_weekly_progress(p_user_id uuid)
+returns table(day text, reps bigint, accuracy numeric)
+language sql stable as $$
+    select to_char(created_at, 'Dy') as day,
+           sum(reps_completed)::bigint as reps,
+           round(avg(accuracy_score)::numeric, 1) as accuracy
+    from user_sessions
+    where user_id = p_user_id
+    group by 1;
+$$;
@@ -13,7 +13,8 @@ interface Exercise {
 interface ExercisePlan { ailment: string; exercises: Exercise[]; }
 interface LiveSessionProps { plan: ExercisePlan; exercise: Exercise; onComplete: () => void; }
 interface FeedbackItem { type: 'correction' | 'encouragement' | 'warning' | 'progress'; message: string; }
-interface Landmark { x: number; y: number; visibility: number; }
+// Landmarks arrive as flat [x, y, visibility] triples (no per-point objects).
+type Landmark = [number, number, number];
 interface Coordinate { x: number; y: number; }
 interface DrawingData { landmarks: Landmark[]; angleData?: { angle: number; A: Coordinate; B: Coordinate; C: Coordinate; } }
 
@@ -41,14 +42,14 @@ const drawLandmarks = (
     POSE_CONNECTIONS.forEach(([i, j]) => {
         const p1 = landmarks[i];
         const p2 = landmarks[j];
-        if (p1?.visibility > 0.6 && p2?.visibility > 0.6) {
-            ctx.beginPath(); ctx.moveTo(p1.x * width, p1.y * height); ctx.lineTo(p2.x * width, p2.y * height); ctx.stroke();
+        if (p1 && p2 && p1[2] > 0.6 && p2[2] > 0.6) {
+            ctx.beginPath(); ctx.moveTo(p1[0] * width, p1[1] * height); ctx.lineTo(p2[0] * width, p2[1] * height); ctx.stroke();
         }
     });
 
     ctx.fillStyle = '#FF7F50';
     landmarks.forEach(p => {
-        if (p.visibility > 0.6) { ctx.beginPath(); ctx.arc(p.x * width, p.y * height, 6, 0, 2 * Math.PI); ctx.fill(); }
+        if (p[2] > 0.6) { ctx.beginPath(); ctx.arc(p[0] * width, p[1] * height, 6, 0, 2 * Math.PI); ctx.fill(); }
     });
 
     if (angleData && angleData.angle > 0) {
@@ -295,9 +296,13 @@ export const LiveSession: React.FC<LiveSessionProps> = ({ exercise, onComplete }
             setFeedback(data.feedback);
             setAccuracy(data.accuracy_score);
             
+            // angle_coords arrives as a flat [ax, ay, bx, by, cx, cy] array.
+            const ac = data.angle_coords;
             setDrawingData({
                 landmarks: data.drawing_landmarks,
-                angleData: { angle: data.current_angle, A: data.angle_coords.A, B: data.angle_coords.B, C: data.angle_coords.C }
+                angleData: Array.isArray(ac) && ac.length === 6
+                    ? { angle: data.current_angle, A: { x: ac[0], y: ac[1] }, B: { x: ac[2], y: ac[3] }, C: { x: ac[4], y: ac[5] } }
+                    : undefined
             });
             
             if (data.reps >= exercise.target_reps && setsCompleted < exercise.sets) {